@@ -0,0 +1,174 @@
+import argparse
+import folium
+import numpy as np
+from branca.element import MacroElement
+from folium.plugins import HeatMap
+from folium.raster_layers import ImageOverlay
+from jinja2 import Template
+from osgb import grid_to_wgs84, wgs84_to_grid
+from scipy.ndimage import convolve1d
+from pub_data import PUBS_CSV, load_pubs
+
+HEAT_HTML = 'ldn_pubs_heat.html'
+HEAT_GRIDS = 'ldn_pubs_heat.npz'
+# (lowest map zoom the level is shown at, cell size in metres)
+LEVELS = [(0, 2000), (11, 1000), (12, 500), (13, 250)]
+KERNELS = ('gaussian', 'epanechnikov', 'box', 'none')
+# heat ramp for the image overlay, transparent where there are no pubs
+RAMP = np.array([[0, 0, 255], [0, 255, 255], [0, 255, 0], [255, 255, 0], [255, 0, 0]], dtype='float64')
+
+# show only the heat layer matching the current zoom
+LEVEL_SWITCH_TEMPLATE = Template("""
+{% macro script(this, kwargs) %}
+    (function(map) {
+        var levels = [{% for zoom, layer in this.levels %}[{{ zoom }}, {{ layer.get_name() }}]{{ ',' if not loop.last }}{% endfor %}];
+        function pick() {
+            var z = map.getZoom(), active = levels[0][1];
+            levels.forEach(function(l) { if (z >= l[0]) { active = l[1]; } });
+            levels.forEach(function(l) {
+                if (l[1] === active) { map.addLayer(l[1]); } else { map.removeLayer(l[1]); }
+            });
+        }
+        map.on('zoomend', pick);
+        pick();
+    })({{ this._parent.get_name() }});
+{% endmacro %}
+""")
+
+
+class LevelSwitch(MacroElement):
+    def __init__(self, levels):
+        super(LevelSwitch, self).__init__()
+        self._name = 'LevelSwitch'
+        self._template = LEVEL_SWITCH_TEMPLATE
+        self.levels = levels
+
+
+def kernel_weights(kernel, bandwidth, cell):
+    """1-D kernel sampled at cell centres, normalised so pub counts are preserved."""
+    if kernel not in KERNELS:
+        raise ValueError('unknown kernel: {}'.format(kernel))
+    h = bandwidth / cell
+    if kernel == 'none' or h <= 0:
+        return np.ones(1)
+    if kernel == 'gaussian':
+        offsets = np.arange(-int(np.ceil(3 * h)), int(np.ceil(3 * h)) + 1)
+        w = np.exp(-0.5 * (offsets / h) ** 2)
+    else:
+        offsets = np.arange(-int(np.floor(h)), int(np.floor(h)) + 1)
+        w = 1 - (offsets / (h + 1)) ** 2 if kernel == 'epanechnikov' else np.ones(len(offsets))
+    return w / w.sum()
+
+
+def build_grids(pubs_df, levels=LEVELS, kernel='gaussian', bandwidth=500.0):
+    """Bin pubs on easting/northing into one smoothed density grid per level."""
+    grid_ok = pubs_df['grid_ok'].to_numpy()
+    e = pubs_df['easting'].to_numpy(dtype='float64', na_value=0)[grid_ok]
+    n = pubs_df['northing'].to_numpy(dtype='float64', na_value=0)[grid_ok]
+    grids = []
+    for min_zoom, cell in levels:
+        w = kernel_weights(kernel, bandwidth, cell)
+        # pad by the kernel reach and snap to the cell size so levels line up
+        pad = (len(w) // 2 + 1) * cell
+        x0, y0 = np.floor((e.min() - pad) / cell) * cell, np.floor((n.min() - pad) / cell) * cell
+        x1, y1 = np.ceil((e.max() + pad) / cell) * cell, np.ceil((n.max() + pad) / cell) * cell
+        counts, _, _ = np.histogram2d(n, e, bins=[int((y1 - y0) / cell), int((x1 - x0) / cell)],
+                                      range=[[y0, y1], [x0, x1]])
+        density = convolve1d(convolve1d(counts, w, axis=0, mode='constant'), w, axis=1, mode='constant')
+        grids.append({'min_zoom': min_zoom, 'cell': cell, 'origin': (x0, y0), 'density': density})
+    return grids
+
+
+def save_grids(grids, path=HEAT_GRIDS):
+    # each grid is quantised to uint16 against its own maximum
+    arrays = {}
+    for i, g in enumerate(grids):
+        peak = g['density'].max() or 1.0
+        arrays['density_{}'.format(i)] = np.round(g['density'] / peak * 65535).astype('uint16')
+        arrays['meta_{}'.format(i)] = np.array([g['min_zoom'], g['cell'], g['origin'][0], g['origin'][1], peak])
+    np.savez_compressed(path, **arrays)
+
+
+def load_grids(path=HEAT_GRIDS):
+    grids = []
+    with np.load(path) as data:
+        for i in range(len(data.files) // 2):
+            min_zoom, cell, x0, y0, peak = data['meta_{}'.format(i)]
+            density = data['density_{}'.format(i)].astype('float64') * (peak / 65535)
+            grids.append({'min_zoom': int(min_zoom), 'cell': float(cell), 'origin': (x0, y0), 'density': density})
+    return grids
+
+
+def grid_points(grid, threshold=0.05):
+    """Weighted [lat, lng, w] points for the cells above threshold of the grid's peak."""
+    density = grid['density']
+    peak = density.max() or 1.0
+    rows, cols = np.nonzero(density > threshold * peak)
+    cell = grid['cell']
+    lat, lng = grid_to_wgs84(grid['origin'][0] + (cols + 0.5) * cell, grid['origin'][1] + (rows + 0.5) * cell)
+    weights = density[rows, cols] / peak
+    return np.column_stack([lat, lng, weights]).round(6).tolist()
+
+
+def grid_image(grid, opacity=0.6):
+    """RGBA image of the grid resampled onto a latitude/longitude raster, and its bounds."""
+    density = grid['density']
+    h, w = density.shape
+    cell = grid['cell']
+    x0, y0 = grid['origin']
+    corner_lat, corner_lng = grid_to_wgs84(np.array([x0, x0, x0 + w * cell, x0 + w * cell]),
+                                       np.array([y0, y0 + h * cell, y0, y0 + h * cell]))
+    south, north = corner_lat.min(), corner_lat.max()
+    west, east = corner_lng.min(), corner_lng.max()
+    # row 0 is the north edge, as ImageOverlay expects
+    lat = np.linspace(north, south, h)
+    lng = np.linspace(west, east, w)
+    lat_mesh, lng_mesh = np.meshgrid(lat, lng, indexing='ij')
+    e, n = wgs84_to_grid(lat_mesh.ravel(), lng_mesh.ravel())
+    cols = np.floor((e - x0) / cell).astype('int64')
+    rows = np.floor((n - y0) / cell).astype('int64')
+    inside = (cols >= 0) & (cols < w) & (rows >= 0) & (rows < h)
+    value = np.zeros(len(e))
+    value[inside] = density[rows[inside], cols[inside]]
+    value = (value / (density.max() or 1.0)).reshape(h, w)
+    pos = value * (len(RAMP) - 1)
+    low = np.minimum(np.floor(pos).astype('int64'), len(RAMP) - 2)
+    frac = (pos - low)[..., None]
+    rgba = np.zeros((h, w, 4), dtype='uint8')
+    rgba[..., :3] = np.round(RAMP[low] * (1 - frac) + RAMP[low + 1] * frac)
+    rgba[..., 3] = np.round(255 * opacity * np.sqrt(value))
+    return rgba, [[south, west], [north, east]]
+
+
+def build_heat_map(grids, mode='points'):
+    map_pubs = folium.Map(location=[51.51, -0.12], zoom_start=12)
+    layers = []
+    for grid in grids:
+        if mode == 'image':
+            rgba, bounds = grid_image(grid)
+            layer = ImageOverlay(rgba, bounds, mercator_project=True, pixelated=False,
+                                 name='{:g} m'.format(grid['cell']))
+        else:
+            layer = HeatMap(grid_points(grid), name='{:g} m'.format(grid['cell']),
+                            radius=25, blur=15, min_opacity=0.5)
+        layer.add_to(map_pubs)
+        layers.append((grid['min_zoom'], layer))
+    LevelSwitch(layers).add_to(map_pubs)
+    return map_pubs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Heat map of pubs from pre-binned density grids.')
+    parser.add_argument('--csv', default=PUBS_CSV)
+    parser.add_argument('--mode', choices=('points', 'image'), default='points')
+    parser.add_argument('--kernel', choices=KERNELS, default='gaussian')
+    parser.add_argument('--bandwidth', type=float, default=500.0, help='kernel bandwidth in metres')
+    parser.add_argument('--grids', default=HEAT_GRIDS)
+    parser.add_argument('--out', default=HEAT_HTML)
+    args = parser.parse_args(argv)
+    save_grids(build_grids(load_pubs(args.csv), kernel=args.kernel, bandwidth=args.bandwidth), args.grids)
+    build_heat_map(load_grids(args.grids), args.mode).save(args.out)
+
+
+if __name__ == '__main__':
+    main()
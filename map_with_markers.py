@@ -1,19 +1,70 @@
 import folium
 import re
-import csv
-pubs_data = []
-with open('london_pubs.csv', 'r') as numPub:
-    pubs = csv.DictReader(numPub)
-    for row in pubs:
-        pubs_data.append(row)
-# create map
-map_pubs = folium.Map(location=[51.51, -0.12], zoom_start=12)
-# plot pub locations
-for row in pubs_data:
-    try:
-        popup_text = "{}\n{}".format(re.sub(r'[^A-Za-z0-9 ]+', '', row['name']), row['local_authority'])
-        folium.Marker(location=[float(row['latitude']), float(row['longitude'])], popup=popup_text).add_to(map_pubs)
-    except ValueError:
-        continue
-# display(map_pubs)
-map_pubs.save('london_pubs.html')
\ No newline at end of file
+import sys
+import json
+from branca.element import MacroElement
+from jinja2 import Template
+from pub_data import load_pubs
+
+# one canvas layer fed from a single embedded array; popups are built when a point is clicked
+PUB_LAYER_TEMPLATE = Template("""
+{% macro script(this, kwargs) %}
+    var {{ this.get_name() }} = (function(map) {
+        var areas = {{ this.areas }};
+        var pubs = {{ this.pubs }};
+        var renderer = L.canvas({padding: 0.5});
+        var layer = L.featureGroup();
+        for (var i = 0; i < pubs.length; i++) {
+            var m = L.circleMarker([pubs[i][0], pubs[i][1]], {
+                renderer: renderer, radius: 4, weight: 1,
+                color: '#2f3e58', fillColor: '#e84e1b', fillOpacity: 0.8
+            });
+            m.pubIndex = i;
+            layer.addLayer(m);
+        }
+        layer.on('click', function(e) {
+            var pub = pubs[e.layer.pubIndex];
+            var content = document.createElement('div');
+            content.appendChild(document.createTextNode(pub[2]));
+            content.appendChild(document.createElement('br'));
+            content.appendChild(document.createTextNode(areas[pub[3]]));
+            L.popup().setLatLng(e.latlng).setContent(content).openOn(map);
+        });
+        return layer.addTo(map);
+    })({{ this._parent.get_name() }});
+{% endmacro %}
+""")
+
+
+class PubLayer(MacroElement):
+    def __init__(self, pubs_df):
+        super(PubLayer, self).__init__()
+        self._name = 'PubLayer'
+        self._template = PUB_LAYER_TEMPLATE
+        pubs_df = pubs_df[pubs_df['coords_ok']]
+        areas = pubs_df['local_authority'].cat.categories.tolist()
+        names = pubs_df['name'].str.replace(r'[^A-Za-z0-9 ]+', '', regex=True)
+        pubs = list(zip(pubs_df['latitude'].round(6).tolist(), pubs_df['longitude'].round(6).tolist(),
+                        names.tolist(), pubs_df['local_authority'].cat.codes.tolist()))
+        self.areas = json.dumps(areas, separators=(',', ':'))
+        self.pubs = json.dumps(pubs, separators=(',', ':'))
+
+
+def build_marker_map(pubs_df, per_marker=False):
+    # create map
+    map_pubs = folium.Map(location=[51.51, -0.12], zoom_start=12, prefer_canvas=not per_marker)
+    if not per_marker:
+        PubLayer(pubs_df).add_to(map_pubs)
+        return map_pubs
+    # plot pub locations, one folium.Marker each
+    for row in pubs_df[pubs_df['coords_ok']].itertuples():
+        popup_text = "{}\n{}".format(re.sub(r'[^A-Za-z0-9 ]+', '', row.name), row.local_authority)
+        folium.Marker(location=[row.latitude, row.longitude], popup=popup_text).add_to(map_pubs)
+    return map_pubs
+
+
+if __name__ == '__main__':
+    # pass --per-marker for the old output with one folium.Marker per pub
+    map_pubs = build_marker_map(load_pubs(), per_marker='--per-marker' in sys.argv[1:])
+    # display(map_pubs)
+    map_pubs.save('london_pubs.html')
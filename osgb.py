@@ -0,0 +1,120 @@
+import numpy as np
+
+# Ordnance Survey National Grid projection on the Airy 1830 ellipsoid
+AIRY_A, AIRY_B = 6377563.396, 6356256.909
+WGS84_A, WGS84_B = 6378137.000, 6356752.3142
+F0 = 0.9996012717
+LAT0, LNG0 = np.radians(49.0), np.radians(-2.0)
+E0, N0 = 400000.0, -100000.0
+# OSGB36 -> WGS84 Helmert parameters: metres, ppm, arc seconds
+HELMERT_T = (446.448, -125.157, 542.060)
+HELMERT_S = -20.4894
+HELMERT_R = (0.1502, 0.2470, 0.8421)
+
+
+def _meridional_arc(lat, n):
+    d, s = lat - LAT0, lat + LAT0
+    return AIRY_B * F0 * ((1 + n + 1.25 * n ** 2 + 1.25 * n ** 3) * d
+                          - (3 * n + 3 * n ** 2 + 21 / 8 * n ** 3) * np.sin(d) * np.cos(s)
+                          + (15 / 8 * n ** 2 + 15 / 8 * n ** 3) * np.sin(2 * d) * np.cos(2 * s)
+                          - 35 / 24 * n ** 3 * np.sin(3 * d) * np.cos(3 * s))
+
+
+def grid_to_osgb36(easting, northing):
+    """Inverse transverse Mercator: grid metres to OSGB36 latitude/longitude in radians."""
+    e = np.asarray(easting, dtype='float64')
+    north = np.asarray(northing, dtype='float64')
+    n = (AIRY_A - AIRY_B) / (AIRY_A + AIRY_B)
+    e2 = 1 - AIRY_B ** 2 / AIRY_A ** 2
+    lat = (north - N0) / (AIRY_A * F0) + LAT0
+    # converges to 0.01 mm in a handful of rounds for any point on the grid
+    for _ in range(20):
+        residual = north - N0 - _meridional_arc(lat, n)
+        if np.all(np.abs(residual[np.isfinite(residual)]) < 1e-5):
+            break
+        lat = lat + residual / (AIRY_A * F0)
+    sin2 = np.sin(lat) ** 2
+    nu = AIRY_A * F0 / np.sqrt(1 - e2 * sin2)
+    rho = AIRY_A * F0 * (1 - e2) / (1 - e2 * sin2) ** 1.5
+    eta2 = nu / rho - 1
+    tan = np.tan(lat)
+    sec = 1 / np.cos(lat)
+    vii = tan / (2 * rho * nu)
+    viii = tan / (24 * rho * nu ** 3) * (5 + 3 * tan ** 2 + eta2 - 9 * tan ** 2 * eta2)
+    ix = tan / (720 * rho * nu ** 5) * (61 + 90 * tan ** 2 + 45 * tan ** 4)
+    x = sec / nu
+    xi = sec / (6 * nu ** 3) * (nu / rho + 2 * tan ** 2)
+    xii = sec / (120 * nu ** 5) * (5 + 28 * tan ** 2 + 24 * tan ** 4)
+    xiia = sec / (5040 * nu ** 7) * (61 + 662 * tan ** 2 + 1320 * tan ** 4 + 720 * tan ** 6)
+    de = e - E0
+    lat = lat - vii * de ** 2 + viii * de ** 4 - ix * de ** 6
+    lng = LNG0 + x * de - xi * de ** 3 + xii * de ** 5 - xiia * de ** 7
+    return lat, lng
+
+
+def osgb36_to_grid(lat, lng):
+    """Transverse Mercator: OSGB36 latitude/longitude in radians to grid metres."""
+    lat = np.asarray(lat, dtype='float64')
+    lng = np.asarray(lng, dtype='float64')
+    n = (AIRY_A - AIRY_B) / (AIRY_A + AIRY_B)
+    e2 = 1 - AIRY_B ** 2 / AIRY_A ** 2
+    sin, cos, tan = np.sin(lat), np.cos(lat), np.tan(lat)
+    nu = AIRY_A * F0 / np.sqrt(1 - e2 * sin ** 2)
+    rho = AIRY_A * F0 * (1 - e2) / (1 - e2 * sin ** 2) ** 1.5
+    eta2 = nu / rho - 1
+    i = _meridional_arc(lat, n) + N0
+    ii = nu / 2 * sin * cos
+    iii = nu / 24 * sin * cos ** 3 * (5 - tan ** 2 + 9 * eta2)
+    iiia = nu / 720 * sin * cos ** 5 * (61 - 58 * tan ** 2 + tan ** 4)
+    iv = nu * cos
+    v = nu / 6 * cos ** 3 * (nu / rho - tan ** 2)
+    vi = nu / 120 * cos ** 5 * (5 - 18 * tan ** 2 + tan ** 4 + 14 * eta2 - 58 * tan ** 2 * eta2)
+    dl = lng - LNG0
+    northing = i + ii * dl ** 2 + iii * dl ** 4 + iiia * dl ** 6
+    easting = E0 + iv * dl + v * dl ** 3 + vi * dl ** 5
+    return easting, northing
+
+
+def _to_cartesian(lat, lng, a, b):
+    e2 = 1 - b ** 2 / a ** 2
+    nu = a / np.sqrt(1 - e2 * np.sin(lat) ** 2)
+    return (nu * np.cos(lat) * np.cos(lng), nu * np.cos(lat) * np.sin(lng), (1 - e2) * nu * np.sin(lat))
+
+
+def _from_cartesian(x, y, z, a, b):
+    e2 = 1 - b ** 2 / a ** 2
+    p = np.hypot(x, y)
+    lat = np.arctan2(z, p * (1 - e2))
+    for _ in range(10):
+        nu = a / np.sqrt(1 - e2 * np.sin(lat) ** 2)
+        lat = np.arctan2(z + e2 * nu * np.sin(lat), p)
+    return lat, np.arctan2(y, x)
+
+
+def _helmert(x, y, z, sign):
+    # sign -1 applies the transform backwards, WGS84 -> OSGB36, to well under a metre
+    tx, ty, tz = (sign * t for t in HELMERT_T)
+    s = sign * HELMERT_S * 1e-6
+    rx, ry, rz = (sign * np.radians(r / 3600) for r in HELMERT_R)
+    return (tx + (1 + s) * x - rz * y + ry * z,
+            ty + rz * x + (1 + s) * y - rx * z,
+            tz - ry * x + rx * y + (1 + s) * z)
+
+
+def grid_to_wgs84(easting, northing):
+    """British National Grid easting/northing arrays to WGS84 latitude/longitude in degrees.
+
+    Uses the OS seven-parameter Helmert transform, which is good to a few
+    metres; NaN in gives NaN out.
+    """
+    lat, lng = grid_to_osgb36(easting, northing)
+    x, y, z = _helmert(*_to_cartesian(lat, lng, AIRY_A, AIRY_B), 1)
+    lat, lng = _from_cartesian(x, y, z, WGS84_A, WGS84_B)
+    return np.degrees(lat), np.degrees(lng)
+
+
+def wgs84_to_grid(lat, lng):
+    """WGS84 latitude/longitude in degrees to British National Grid easting/northing, the inverse of grid_to_wgs84."""
+    lat, lng = np.radians(np.asarray(lat, dtype='float64')), np.radians(np.asarray(lng, dtype='float64'))
+    x, y, z = _helmert(*_to_cartesian(lat, lng, WGS84_A, WGS84_B), -1)
+    return osgb36_to_grid(*_from_cartesian(x, y, z, AIRY_A, AIRY_B))
@@ -0,0 +1,183 @@
+import hashlib
+import io
+import os
+import pickle
+import numpy as np
+import pandas as pd
+from pub_data import PUBS_CSV, CACHE_DIR, parse_pubs, postcode_cache_path
+
+COUNTS_CSV = 'every_pub_in_london.csv'
+STATE_VERSION = 5
+HASH_CHUNK = 1 << 20
+SUM_FIELDS = ['count', 'coords_ok', 'grid_ok', 'easting', 'northing', 'latitude', 'longitude']
+
+
+def _contributions(df):
+    # per-row values that get summed per borough; bad coordinates count as zero.
+    # rows without a usable fas_id can't be keyed, so they are left out
+    df = df[df['fas_id'].notna().to_numpy()]
+    ok = df['coords_ok'].to_numpy()
+    grid_ok = df['grid_ok'].to_numpy()
+    return pd.DataFrame({
+        'fas_id': df['fas_id'].to_numpy(dtype='int64'),
+        'local_authority': df['local_authority'].astype(str).to_numpy(),
+        'count': np.ones(len(df), dtype='int64'),
+        'coords_ok': ok.astype('int64'),
+        'grid_ok': grid_ok.astype('int64'),
+        'easting': np.where(grid_ok, df['easting'].to_numpy(dtype='float64', na_value=0), 0.0),
+        'northing': np.where(grid_ok, df['northing'].to_numpy(dtype='float64', na_value=0), 0.0),
+        'latitude': np.where(ok, df['latitude'].to_numpy(), 0.0),
+        'longitude': np.where(ok, df['longitude'].to_numpy(), 0.0),
+    })
+
+
+class BoroughAggregate:
+    """Per-borough sums over the pub table, updatable row by row keyed on fas_id.
+
+    skipped_lines counts the malformed CSV lines parse_pubs left out.
+    """
+
+    def __init__(self):
+        self.sums = {}
+        self.rows = {}
+        self.skipped_lines = 0
+
+    @classmethod
+    def from_frame(cls, df):
+        agg = cls()
+        rows = _contributions(df).drop_duplicates('fas_id', keep='last')
+        grouped = rows.groupby('local_authority', sort=False)[SUM_FIELDS].sum()
+        agg.sums = {la: list(vals) for la, vals in zip(grouped.index, grouped.to_numpy(dtype='float64').tolist())}
+        values = rows[['local_authority'] + SUM_FIELDS].itertuples(index=False, name=None)
+        agg.rows = dict(zip(rows['fas_id'].tolist(), values))
+        agg.skipped_lines = len(df.attrs.get('skipped_lines', []))
+        return agg
+
+    def _add(self, row, sign):
+        sums = self.sums.setdefault(row[0], [0.0] * len(SUM_FIELDS))
+        for i, value in enumerate(row[1:]):
+            sums[i] += sign * value
+        if sums[0] <= 0:
+            del self.sums[row[0]]
+
+    def update(self, df):
+        """Apply appended or re-sent rows; a fas_id seen before replaces the old row."""
+        self.skipped_lines += len(df.attrs.get('skipped_lines', []))
+        rows = _contributions(df).drop_duplicates('fas_id', keep='last')
+        values = rows[['local_authority'] + SUM_FIELDS].itertuples(index=False, name=None)
+        for fas_id, row in zip(rows['fas_id'].tolist(), values):
+            old = self.rows.get(fas_id)
+            if old is not None:
+                self._add(old, -1)
+            self._add(row, 1)
+            self.rows[fas_id] = row
+        return len(rows)
+
+    def summary(self):
+        sums = pd.DataFrame.from_dict(self.sums, orient='index', columns=SUM_FIELDS)
+        out = pd.DataFrame({
+            'Local Authority': sums.index,
+            'Number of Pubs': sums['count'].round().astype('int64').to_numpy(),
+        })
+        total = out['Number of Pubs'].sum()
+        located = sums['coords_ok'].replace(0, np.nan).to_numpy()
+        gridded = sums['grid_ok'].replace(0, np.nan).to_numpy()
+        out['Share of Pubs'] = (out['Number of Pubs'] / total * 100).round(2) if total else 0.0
+        out['Missing Coordinates'] = (sums['count'] - sums['coords_ok']).round().astype('int64').to_numpy()
+        out['Mean Easting'] = (sums['easting'].to_numpy() / gridded).round()
+        out['Mean Northing'] = (sums['northing'].to_numpy() / gridded).round()
+        out['Mean Latitude'] = (sums['latitude'].to_numpy() / located).round(6)
+        out['Mean Longitude'] = (sums['longitude'].to_numpy() / located).round(6)
+        return out.sort_values(['Number of Pubs', 'Local Authority'],
+                               ascending=[False, True]).reset_index(drop=True)
+
+
+def _state_path(path):
+    path = os.path.abspath(path)
+    return os.path.join(os.path.dirname(path), CACHE_DIR, os.path.basename(path) + '.agg.pkl')
+
+
+def _prefix_sha1(f, offset):
+    """SHA-1 object over the first offset bytes of f."""
+    digest = hashlib.sha1()
+    f.seek(0)
+    remaining = offset
+    while remaining > 0:
+        chunk = f.read(min(HASH_CHUNK, remaining))
+        if not chunk:
+            break
+        digest.update(chunk)
+        remaining -= len(chunk)
+    return digest
+
+
+def _load_state(path):
+    try:
+        with open(_state_path(path), 'rb') as f:
+            state = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if not isinstance(state, dict) or state.get('version') != STATE_VERSION:
+        return None
+    return state
+
+
+def _save_state(path, state):
+    snap = _state_path(path)
+    os.makedirs(os.path.dirname(snap), exist_ok=True)
+    with open(snap + '.tmp', 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(snap + '.tmp', snap)
+
+
+def borough_aggregate(path=PUBS_CSV):
+    """Return the BoroughAggregate for path, parsing only bytes appended since the last call.
+
+    The SHA-1 of everything read last time is kept; if that prefix changed in
+    any way (an edited, inserted or removed row), everything is recomputed.
+    If the file last ended mid-line, the appended bytes are still parsed as
+    new rows, as if the missing newline were there; a full parse would see the
+    old last row and the first new one as a single malformed line and skip both.
+    """
+    state = _load_state(path)
+    # the tail is parsed from memory, so point it at the postcode cache beside path
+    postcode_cache = postcode_cache_path(path)
+    with open(path, 'rb') as f:
+        header = f.readline()
+        size = os.fstat(f.fileno()).st_size
+        digest = None
+        if state is not None and state['header'] == header and state['offset'] <= size:
+            digest = _prefix_sha1(f, state['offset'])
+            if digest.hexdigest() != state['prefix_sha1']:
+                digest = None
+        if digest is not None:
+            agg = state['aggregate']
+            offset = state['offset']
+            f.seek(offset)
+            tail = f.read()
+            if tail.strip():
+                # the header ends a line, so the tail always starts a new row here
+                head = header if header.endswith(b'\n') else header + b'\n'
+                agg.update(parse_pubs(io.BytesIO(head + tail), postcode_cache=postcode_cache))
+        if digest is None:
+            f.seek(0)
+            tail = f.read()
+            offset = 0
+            digest = hashlib.sha1()
+            agg = BoroughAggregate.from_frame(parse_pubs(io.BytesIO(tail), postcode_cache=postcode_cache))
+        if state is None or tail or agg is not state['aggregate']:
+            digest.update(tail)
+            new_offset = offset + len(tail)
+            _save_state(path, {'version': STATE_VERSION, 'header': header, 'offset': new_offset,
+                               'prefix_sha1': digest.hexdigest(), 'aggregate': agg})
+    return agg
+
+
+def borough_counts(path=PUBS_CSV):
+    return borough_aggregate(path).summary()
+
+
+if __name__ == '__main__':
+    counts = borough_counts()
+    print(counts)
+    counts[['Local Authority', 'Number of Pubs']].to_csv(COUNTS_CSV, index=False)
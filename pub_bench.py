@@ -0,0 +1,257 @@
+import argparse
+import cProfile
+import json
+import os
+import platform
+import resource
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+import numpy as np
+import pandas as pd
+import heat_map
+import pub_charts
+from map_with_markers import build_marker_map
+from osgb import grid_to_wgs84
+from pub_aggregate import BoroughAggregate
+from pub_data import PUBS_CSV, load_pubs, parse_pubs, fill_coordinates
+
+RESULTS = 'bench_results.jsonl'
+STAGES = ['load', 'clean', 'aggregate', 'markers', 'heatmap', 'charts']
+COLUMNS = ['fas_id', 'name', 'address', 'postcode', 'easting', 'northing', 'latitude', 'longitude',
+           'local_authority']
+
+
+def synthesize(n, source_df, seed=0, spread=400.0, bad_fraction=0.0015):
+    """n schema-compatible pub rows scattered around real pubs.
+
+    Each row copies a random real pub's borough, postcode and address and is
+    jittered by a Gaussian of `spread` metres, so boroughs keep their share
+    and their clusters. A bad_fraction of rows get '\\N' latitude/longitude
+    like the real feed.
+    """
+    rng = np.random.default_rng(seed)
+    src = source_df[(source_df['coords_ok'] & source_df['grid_ok']).to_numpy()].reset_index(drop=True)
+    anchor = rng.integers(0, len(src), n)
+    easting = np.round(src['easting'].to_numpy(dtype='float64')[anchor] + rng.normal(0, spread, n))
+    northing = np.round(src['northing'].to_numpy(dtype='float64')[anchor] + rng.normal(0, spread, n))
+    lat, lng = grid_to_wgs84(easting, northing)
+    bad = rng.random(n) < bad_fraction
+    lat[bad] = np.nan
+    lng[bad] = np.nan
+    return pd.DataFrame({
+        'fas_id': np.arange(10000000, 10000000 + n),
+        'name': src['name'].to_numpy()[anchor] + ' ' + np.arange(n).astype(str),
+        'address': src['address'].to_numpy()[anchor],
+        'postcode': src['postcode'].to_numpy()[anchor],
+        'easting': easting.astype('int64'),
+        'northing': northing.astype('int64'),
+        'latitude': np.round(lat, 6),
+        'longitude': np.round(lng, 6),
+        'local_authority': src['local_authority'].astype(str).to_numpy()[anchor],
+    }, columns=COLUMNS)
+
+
+def write_synthetic(path, n, source_df, seed=0):
+    synthesize(n, source_df, seed=seed).to_csv(path, index=False, na_rep='\\N')
+    return path
+
+
+def _size(*paths):
+    total = 0
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                total += sum(os.path.getsize(os.path.join(root, f)) for f in files)
+        elif os.path.exists(path):
+            total += os.path.getsize(path)
+    return total
+
+
+# each stage takes the shared state dict, may add to it, and returns the files it wrote
+def stage_load(ctx):
+    ctx['df'] = parse_pubs(ctx['csv'], fill_missing=False)
+    return [ctx['csv']]
+
+
+def stage_clean(ctx):
+    fill_coordinates(ctx['df'], os.path.join(ctx['workdir'], 'postcodes.csv'))
+    return []
+
+
+def stage_aggregate(ctx):
+    counts = BoroughAggregate.from_frame(ctx['df']).summary()
+    counts[['Local Authority', 'Number of Pubs']].to_csv('every_pub_in_london.csv', index=False)
+    ctx['counts'] = counts
+    return ['every_pub_in_london.csv']
+
+
+def stage_markers(ctx):
+    build_marker_map(ctx['df']).save('london_pubs.html')
+    return ['london_pubs.html']
+
+
+def stage_heatmap(ctx):
+    heat_map.save_grids(heat_map.build_grids(ctx['df']), heat_map.HEAT_GRIDS)
+    heat_map.build_heat_map(heat_map.load_grids(heat_map.HEAT_GRIDS)).save(heat_map.HEAT_HTML)
+    return [heat_map.HEAT_GRIDS, heat_map.HEAT_HTML]
+
+
+def stage_charts(ctx):
+    specs = (pub_charts.london_charts(ctx['counts']) + pub_charts.borough_charts(ctx['df'])
+             + pub_charts.region_charts(ctx['df']))
+    pub_charts.render_charts(specs, workers=ctx['chart_workers'], force=True,
+                             manifest=os.path.join('charts', 'manifest.json'))
+    return [spec['out'] for spec in specs]
+
+
+STAGE_FUNCS = {name: globals()['stage_' + name] for name in STAGES}
+
+
+def _reset_peak_rss():
+    """Reset the kernel's RSS high-water mark (Linux); False where that isn't possible."""
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _maxrss_mb(who):
+    peak = resource.getrusage(who).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _peak_rss_mb(since_reset=False):
+    if since_reset:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    return _maxrss_mb(resource.RUSAGE_SELF)
+
+
+def run_stage(name, ctx, profile_dir=None, trace=False):
+    """Run one stage and return its measurements."""
+    profiler = cProfile.Profile() if profile_dir else None
+    if trace:
+        tracemalloc.start()
+    reset = _reset_peak_rss()
+    t = time.perf_counter()
+    if profiler:
+        profiler.enable()
+    outputs = STAGE_FUNCS[name](ctx)
+    if profiler:
+        profiler.disable()
+    wall = time.perf_counter() - t
+    # peak_rss_mb covers this stage alone where the high-water mark could be reset,
+    # otherwise it is the process peak so far
+    record = {'stage': name, 'wall_s': round(wall, 4), 'peak_rss_mb': round(_peak_rss_mb(reset), 1),
+              'rss_scope': 'stage' if reset else 'process', 'output_bytes': _size(*outputs),
+              'profiled': bool(profiler), 'traced': trace}
+    if name == 'charts':
+        record['chart_workers'] = ctx['chart_workers']
+        if ctx['chart_workers'] != 1:
+            # pool workers aren't in /proc/self; this is the largest one's peak, and
+            # like ru_maxrss it can't be reset, so it covers every pool run so far
+            record['worker_peak_rss_mb'] = round(_maxrss_mb(resource.RUSAGE_CHILDREN), 1)
+            record['rss_scope'] += ' without workers'
+    if trace:
+        record['traced_peak_mb'] = round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1)
+        tracemalloc.stop()
+    if profiler:
+        os.makedirs(profile_dir, exist_ok=True)
+        path = os.path.join(profile_dir, '{}_{}.prof'.format(ctx['rows'], name))
+        profiler.dump_stats(path)
+        record['profile'] = path
+    return record
+
+
+def run_benchmark(rows, stages=STAGES, source=PUBS_CSV, workdir=None, profile=(), trace=(), seed=0,
+                  chart_workers=1):
+    """Generate a table of `rows` pubs (0 means the source file itself) and time each stage on it."""
+    source = os.path.abspath(source)
+    source_df = load_pubs(source)
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix='pub_bench_'))
+    os.makedirs(workdir, exist_ok=True)
+    here = os.getcwd()
+    os.chdir(workdir)
+    try:
+        csv = source if rows == 0 else write_synthetic('pubs_{}.csv'.format(rows), rows, source_df, seed)
+        ctx = {'csv': csv, 'rows': rows or len(source_df), 'workdir': workdir, 'chart_workers': chart_workers}
+        # stages build on each other, so run every earlier one the chosen stages need
+        needed = STAGES[:max(STAGES.index(s) for s in stages) + 1]
+        records = []
+        for name in needed:
+            record = run_stage(name, ctx, os.path.join(workdir, 'profiles') if name in profile else None,
+                               name in trace)
+            record['rows'] = ctx['rows']
+            if name in stages:
+                records.append(record)
+        return records
+    finally:
+        os.chdir(here)
+
+
+def _compare_key(r):
+    # profiling, tracing and the chart pool size all change wall times, so runs only match like for like
+    return r['rows'], r['stage'], r.get('profiled', False), r.get('traced', False), r.get('chart_workers')
+
+
+def load_latest(path):
+    """Latest record per comparable run (rows, stage, profiled, traced, chart workers) in a results file."""
+    latest = {}
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                r = json.loads(line)
+                latest[_compare_key(r)] = r
+    return latest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Time each pipeline stage on synthetic pub tables.')
+    parser.add_argument('--rows', nargs='+', type=int, default=[10000, 100000, 1000000],
+                        help='table sizes; 0 benchmarks the source CSV as is')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--source', default=PUBS_CSV, help='real table the synthetic rows are drawn around')
+    parser.add_argument('--workdir', help='where generated tables and outputs go (default: a temp dir)')
+    parser.add_argument('--profile', nargs='*', choices=STAGES, default=[], help='stages to run under cProfile')
+    parser.add_argument('--tracemalloc', nargs='*', choices=STAGES, default=[],
+                        help='stages to trace Python allocations for')
+    parser.add_argument('--results', default=RESULTS, help='JSON lines file results are appended to')
+    parser.add_argument('--baseline', help='results file to compare wall times against')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--chart-workers', type=int, default=1,
+                        help='processes for the charts stage; the default 1 keeps all its memory in peak_rss_mb')
+    args = parser.parse_args(argv)
+
+    baseline = load_latest(args.baseline) if args.baseline else None
+    run_id = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    meta = {'run_id': run_id, 'python': platform.python_version(), 'machine': platform.machine(),
+            'numpy': np.__version__, 'pandas': pd.__version__}
+    print('{:>9} {:<10} {:>9} {:>9} {:>12}'.format('rows', 'stage', 'wall s', 'rss MB', 'out bytes'))
+    records = []
+    for rows in args.rows:
+        workdir = os.path.join(args.workdir, str(rows)) if args.workdir else None
+        for record in run_benchmark(rows, args.stages, args.source, workdir, args.profile,
+                                    args.tracemalloc, args.seed, args.chart_workers):
+            record.update(meta)
+            records.append(record)
+            print('{rows:>9} {stage:<10} {wall_s:>9.3f} {peak_rss_mb:>9.1f} {output_bytes:>12}'.format(**record))
+            with open(args.results, 'a') as f:
+                f.write(json.dumps(record, sort_keys=True) + '\n')
+    if baseline:
+        for r in records:
+            before = baseline.get(_compare_key(r))
+            if before and before['wall_s']:
+                print('{:>9} {:<10} {:>6.2f}x baseline wall time'.format(r['rows'], r['stage'],
+                                                                        r['wall_s'] / before['wall_s']))
+
+
+if __name__ == '__main__':
+    main()
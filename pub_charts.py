@@ -0,0 +1,166 @@
+import argparse
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from pub_aggregate import borough_counts
+from pub_data import CACHE_DIR, PUBS_CSV, load_pubs
+
+# bump when draw() changes so every chart is redrawn
+RENDER_VERSION = 1
+CHART_DIR = 'charts'
+MANIFEST = os.path.join(CACHE_DIR, 'charts.json')
+PRIMARY_COLOUR = '#e84e1b'
+SECONDARY_COLOUR = '#2f3e58'
+PIE_COLOURS = ['#e84e1b', '#2f3e58', '#ffdd00', '#ebe3dd', '#a9d9d9', '#5b2b3e', '#e7326d']
+# below this many stale charts it is cheaper to draw them here than to start a pool
+POOL_MIN_CHARTS = 8
+
+
+def chart(kind, out, labels, values, title, xlabel=None, ylabel=None, colour=PRIMARY_COLOUR):
+    """Spec for one figure; kind is 'bar', 'bar_mean' or 'pie'."""
+    if kind not in ('bar', 'bar_mean', 'pie'):
+        raise ValueError('unknown chart kind: {}'.format(kind))
+    return {'kind': kind, 'out': out, 'labels': [str(label) for label in labels],
+            'values': [int(v) for v in values], 'title': title, 'xlabel': xlabel,
+            'ylabel': ylabel, 'colour': colour}
+
+
+def spec_hash(spec):
+    payload = json.dumps([RENDER_VERSION, spec], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+def _slug(text):
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')
+
+
+def london_charts(counts):
+    """The three London-wide charts, from borough_counts()."""
+    top = counts.head(7)
+    return [
+        chart('bar', 'bar_chart1.png', counts['Local Authority'], counts['Number of Pubs'],
+              'Number of Pubs in London', xlabel='Number of Pubs', ylabel='London Boroughs'),
+        chart('pie', 'pie_chart1.png', top['Local Authority'], top['Number of Pubs'],
+              'Seven Boroughs with the highest number of pubs'),
+        chart('bar_mean', 'bar_chart2.png', counts['Local Authority'], counts['Number of Pubs'],
+              'Number of Pubs in London', xlabel='Number of Pubs', ylabel='London Boroughs',
+              colour=SECONDARY_COLOUR),
+    ]
+
+
+def _postcode_parts(pubs_df):
+    postcode = pubs_df['postcode'].str.upper().str.strip()
+    district = postcode.str.split().str[0]
+    area = district.str.extract(r'^([A-Z]+)', expand=False)
+    return district, area
+
+
+def borough_charts(pubs_df, chart_dir=CHART_DIR):
+    """One chart per borough: pubs per postcode district."""
+    district, _ = _postcode_parts(pubs_df)
+    counts = district.groupby([pubs_df['local_authority'].astype(str).to_numpy(), district.to_numpy()]).size()
+    specs = []
+    for borough, per_district in counts.groupby(level=0):
+        per_district = per_district.droplevel(0).sort_values(ascending=False)
+        specs.append(chart('bar_mean', os.path.join(chart_dir, 'borough', _slug(borough) + '.png'),
+                           per_district.index, per_district.to_numpy(), 'Pubs in {}'.format(borough),
+                           xlabel='Number of Pubs', ylabel='Postcode District', colour=SECONDARY_COLOUR))
+    return specs
+
+
+def region_charts(pubs_df, chart_dir=CHART_DIR):
+    """One chart per postcode area (E, EC, N, ...): pubs per borough."""
+    _, area = _postcode_parts(pubs_df)
+    counts = area.groupby([area.to_numpy(), pubs_df['local_authority'].astype(str).to_numpy()]).size()
+    specs = []
+    for region, per_borough in counts.groupby(level=0):
+        per_borough = per_borough.droplevel(0).sort_values(ascending=False)
+        specs.append(chart('bar', os.path.join(chart_dir, 'region', _slug(region) + '.png'),
+                           per_borough.index, per_borough.to_numpy(),
+                           'Pubs in the {} postcode area'.format(region),
+                           xlabel='Number of Pubs', ylabel='London Boroughs'))
+    return specs
+
+
+def draw(spec):
+    """Render one spec to its PNG; runs in a worker process, so no pyplot state is used."""
+    import matplotlib
+    matplotlib.use('Agg')
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    ax = fig.add_subplot()
+    if spec['kind'] == 'pie':
+        ax.pie(spec['values'], labels=spec['labels'], colors=PIE_COLOURS)
+        ax.axis('equal')
+    else:
+        ax.barh(y=spec['labels'], width=spec['values'], color=spec['colour'])
+        if spec['kind'] == 'bar_mean' and spec['values']:
+            mean = sum(spec['values']) / len(spec['values'])
+            ax.axvline(mean, color=PRIMARY_COLOUR, linewidth=2, linestyle='--')
+        ax.set_xlabel(spec['xlabel'])
+        ax.set_ylabel(spec['ylabel'])
+    ax.set_title(spec['title'])
+    out_dir = os.path.dirname(spec['out'])
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    fig.savefig(spec['out'])
+    return spec['out']
+
+
+def _load_manifest(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def render_charts(specs, workers=None, force=False, manifest=MANIFEST):
+    """Draw the specs whose PNG is missing or whose hash changed; returns (drawn, skipped) paths."""
+    done = _load_manifest(manifest)
+    stale = [spec for spec in specs
+             if force or done.get(spec['out']) != spec_hash(spec) or not os.path.exists(spec['out'])]
+    if len(stale) < POOL_MIN_CHARTS or workers == 1:
+        drawn = [draw(spec) for spec in stale]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(stale) // (4 * (workers or os.cpu_count() or 1)))
+            drawn = list(pool.map(draw, stale, chunksize=chunksize))
+    for spec in stale:
+        done[spec['out']] = spec_hash(spec)
+    if stale:
+        if os.path.dirname(manifest):
+            os.makedirs(os.path.dirname(manifest), exist_ok=True)
+        with open(manifest + '.tmp', 'w') as f:
+            json.dump(done, f, indent=1, sort_keys=True)
+        os.replace(manifest + '.tmp', manifest)
+    drawn_outs = set(drawn)
+    return drawn, [spec['out'] for spec in specs if spec['out'] not in drawn_outs]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Render pub charts headlessly, skipping unchanged ones.')
+    parser.add_argument('--csv', default=PUBS_CSV)
+    parser.add_argument('--sets', nargs='+', choices=('london', 'borough', 'region'), default=['london'])
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--force', action='store_true', help='redraw even if nothing changed')
+    args = parser.parse_args(argv)
+    # the table is loaded once; workers only get the small per-chart specs
+    specs = []
+    if 'london' in args.sets:
+        specs += london_charts(borough_counts(args.csv))
+    if 'borough' in args.sets or 'region' in args.sets:
+        pubs_df = load_pubs(args.csv)
+        if 'borough' in args.sets:
+            specs += borough_charts(pubs_df)
+        if 'region' in args.sets:
+            specs += region_charts(pubs_df)
+    drawn, skipped = render_charts(specs, workers=args.workers, force=args.force)
+    print('{} drawn, {} unchanged'.format(len(drawn), len(skipped)))
+
+
+if __name__ == '__main__':
+    main()
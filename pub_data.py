@@ -0,0 +1,232 @@
+import contextlib
+import hashlib
+import io
+import os
+import pickle
+import re
+import warnings
+import numpy as np
+import pandas as pd
+from osgb import grid_to_wgs84
+
+PUBS_CSV = 'london_pubs.csv'
+CACHE_DIR = '.pub_cache'
+POSTCODE_CACHE = 'postcodes.csv'
+# bump when the parsed layout changes so old snapshots are ignored
+SNAPSHOT_VERSION = 4
+# rough box around Great Britain, anything outside is a bad coordinate
+LAT_RANGE = (49.0, 61.0)
+LNG_RANGE = (-9.0, 3.0)
+# rows with the wrong number of fields (e.g. an append joined onto an unterminated
+# last line) are skipped and reported; pandas < 1.3 spells this error_bad_lines=False
+SKIP_BAD_LINES = ({'on_bad_lines': 'warn'} if tuple(int(v) for v in pd.__version__.split('.')[:2]) >= (1, 3)
+                  else {'error_bad_lines': False, 'warn_bad_lines': True})
+# extent of the British National Grid in metres
+EASTING_RANGE = (0, 700000)
+NORTHING_RANGE = (0, 1300000)
+
+
+def file_sha1(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def snapshot_path(path):
+    path = os.path.abspath(path)
+    return os.path.join(os.path.dirname(path), CACHE_DIR, os.path.basename(path) + '.pkl')
+
+
+def postcode_cache_path(path):
+    # one cache per CSV, so other tables in the same directory can't move its pubs
+    return snapshot_path(path)[:-len('.pkl')] + '.' + POSTCODE_CACHE
+
+
+def normalise_postcode(postcode):
+    return ''.join(str(postcode).split()).upper()
+
+
+def postcode_keys(postcodes):
+    """Full postcode, sector ('SW1E 6') and district ('SW1E') keys for a column of postcodes."""
+    full = postcodes.fillna('').str.replace(r'\s+', '', regex=True).str.upper()
+    # the inward code is always the last three characters
+    outward = full.str[:-3].where(full.str.len() > 3, '')
+    sector = (outward + ' ' + full.str[-3:-2]).where(outward != '', '')
+    return full, sector, outward
+
+
+def _read_postcode_cache(path):
+    try:
+        cache = pd.read_csv(path, dtype={'key': str}, keep_default_na=False)
+    except (OSError, ValueError):
+        return pd.DataFrame({'latitude': [], 'longitude': [], 'count': []}, index=pd.Index([], name='key'))
+    return cache.set_index('key')
+
+
+def update_postcode_cache(pubs_df, path=POSTCODE_CACHE):
+    """Merge the pubs' mean coordinates per postcode key into the cache at path and return it."""
+    cache = _read_postcode_cache(path)
+    keys = pd.concat(postcode_keys(pubs_df['postcode']), ignore_index=True)
+    coords = pd.DataFrame({'key': keys.to_numpy(),
+                           'latitude': np.tile(pubs_df['latitude'].to_numpy(), 3),
+                           'longitude': np.tile(pubs_df['longitude'].to_numpy(), 3)})
+    coords = coords[coords['key'] != '']
+    if coords.empty:
+        return cache
+    new = coords.groupby('key').agg(latitude=('latitude', 'mean'), longitude=('longitude', 'mean'),
+                                    count=('latitude', 'size'))
+    new[['latitude', 'longitude']] = new[['latitude', 'longitude']].round(6)
+    # an entry is replaced only by one built from at least as many pubs, so reloading
+    # the same table changes nothing and a small appended batch can't override a full one
+    old_count = cache['count'].reindex(new.index).fillna(0).to_numpy()
+    new = new[new['count'].to_numpy() >= old_count]
+    merged = pd.concat([cache.drop(new.index, errors='ignore'), new]).sort_index()
+    merged['count'] = merged['count'].astype('int64')
+    merged.index.name = 'key'
+    if not merged.equals(cache):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        merged.to_csv(path + '.tmp')
+        os.replace(path + '.tmp', path)
+    return merged
+
+
+def fill_coordinates(df, postcode_cache=POSTCODE_CACHE):
+    """Fill missing latitude/longitude in place, from easting/northing or else the postcode cache.
+
+    coords_source records where each row's coordinates came from: csv, grid,
+    postcode, postcode_sector, postcode_district or missing.
+    """
+    ok = df['coords_ok'].to_numpy()
+    source = np.where(ok, 'csv', 'missing').astype(object)
+    from_grid = ~ok & df['grid_ok'].to_numpy()
+    if from_grid.any():
+        lat, lng = grid_to_wgs84(df['easting'].to_numpy(dtype='float64', na_value=np.nan)[from_grid],
+                                 df['northing'].to_numpy(dtype='float64', na_value=np.nan)[from_grid])
+        df.loc[from_grid, 'latitude'] = lat
+        df.loc[from_grid, 'longitude'] = lng
+        source[from_grid] = 'grid'
+    cache = update_postcode_cache(df[ok], postcode_cache)
+    missing = source == 'missing'
+    if missing.any() and len(cache):
+        levels = zip(('postcode', 'postcode_sector', 'postcode_district'), postcode_keys(df['postcode'][missing]))
+        for name, keys in levels:
+            found = cache.reindex(keys.to_numpy())
+            hit = found['latitude'].notna().to_numpy() & (source[missing] == 'missing')
+            rows = np.flatnonzero(missing)[hit]
+            df.loc[df.index[rows], 'latitude'] = found['latitude'].to_numpy()[hit]
+            df.loc[df.index[rows], 'longitude'] = found['longitude'].to_numpy()[hit]
+            source[rows] = name
+    df['coords_source'] = pd.Categorical(source, categories=['csv', 'grid', 'postcode', 'postcode_sector',
+                                                             'postcode_district', 'missing'])
+    df['coords_ok'] = (df['latitude'].between(*LAT_RANGE) & df['longitude'].between(*LNG_RANGE)).to_numpy()
+    return df
+
+
+def _read_text_csv(path):
+    # pandas reports skipped lines as a ParserWarning, or on stderr before 2.0
+    with warnings.catch_warnings(record=True) as caught, contextlib.redirect_stderr(io.StringIO()) as err:
+        warnings.simplefilter('always')
+        df = pd.read_csv(path, dtype=str, keep_default_na=False, **SKIP_BAD_LINES)
+    messages = err.getvalue()
+    for w in caught:
+        if issubclass(w.category, pd.errors.ParserWarning):
+            messages += str(w.message)
+        else:
+            warnings.warn_explicit(w.message, w.category, w.filename, w.lineno)
+    return df, [int(n) for n in re.findall(r'Skipping line (\d+)', messages)]
+
+
+def _warn_skipped(path, lines):
+    if lines:
+        name = path if isinstance(path, (str, os.PathLike)) else 'pub table'
+        warnings.warn('{}: skipped {} line(s) with the wrong number of fields: {}'.format(
+            name, len(lines), ', '.join(map(str, lines[:10])) + (', ...' if len(lines) > 10 else '')), stacklevel=3)
+
+
+def parse_pubs(path=PUBS_CSV, fill_missing=True, postcode_cache=None):
+    """Parse the pub CSV at path (or an open file) into typed columns.
+
+    The postcode cache defaults to the one kept for path in .pub_cache/, or to
+    .pub_cache/postcodes.csv in the working directory when path is a file object. Lines with the wrong
+    number of fields are skipped with a warning; their line numbers are kept
+    in df.attrs['skipped_lines'].
+    """
+    # read everything as text once, then convert whole columns
+    df, skipped = _read_text_csv(path)
+    _warn_skipped(path, skipped)
+    df['fas_id'] = pd.to_numeric(df['fas_id'], errors='coerce').astype('Int64')
+    for col in ('easting', 'northing'):
+        df[col] = pd.to_numeric(df[col], errors='coerce').round().astype('Int64')
+    for col in ('latitude', 'longitude'):
+        df[col] = pd.to_numeric(df[col], errors='coerce').astype('float64')
+    df['local_authority'] = df['local_authority'].astype('category')
+    # flag bad coordinates in one pass, '\N' and blanks are already NaN here
+    df['coords_ok'] = (df['latitude'].between(*LAT_RANGE) & df['longitude'].between(*LNG_RANGE)).to_numpy()
+    df['grid_ok'] = (df['easting'].between(*EASTING_RANGE) & df['northing'].between(*NORTHING_RANGE)).to_numpy(
+        dtype=bool, na_value=False)
+    if fill_missing:
+        if postcode_cache is None:
+            postcode_cache = (postcode_cache_path(path) if isinstance(path, (str, os.PathLike))
+                              else os.path.join(CACHE_DIR, POSTCODE_CACHE))
+        fill_coordinates(df, postcode_cache)
+    df.attrs['skipped_lines'] = skipped
+    return df
+
+
+def _read_snapshot(snap):
+    try:
+        with open(snap, 'rb') as f:
+            meta = pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+        return None
+    if not isinstance(meta, dict) or meta.get('version') != SNAPSHOT_VERSION:
+        return None
+    return meta
+
+
+def _write_snapshot(snap, meta):
+    os.makedirs(os.path.dirname(snap), exist_ok=True)
+    tmp = snap + '.tmp'
+    with open(tmp, 'wb') as f:
+        pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, snap)
+
+
+def load_pubs(path=PUBS_CSV, drop_bad=False, use_cache=True):
+    """Load the pub table with typed columns.
+
+    Reuses the binary snapshot in .pub_cache/ until the CSV's size/mtime and
+    then its hash change; lines skipped when it was parsed are warned about
+    again on every load. Missing latitude/longitude are filled from
+    easting/northing or the postcode cache (see fill_coordinates); rows still
+    without usable coordinates have coords_ok False, or are removed when
+    drop_bad is set. grid_ok says the same for easting/northing.
+    """
+    if not use_cache:
+        df = parse_pubs(path)
+    else:
+        stat = os.stat(path)
+        snap = snapshot_path(path)
+        meta = _read_snapshot(snap)
+        if meta is not None and (meta['size'], meta['mtime_ns']) == (stat.st_size, stat.st_mtime_ns):
+            df = meta['frame']
+            df.attrs['skipped_lines'] = meta['skipped_lines']
+            _warn_skipped(path, meta['skipped_lines'])
+        else:
+            sha1 = file_sha1(path)
+            if meta is not None and meta['sha1'] == sha1:
+                # touched but unchanged, just refresh the stamp
+                df = meta['frame']
+                df.attrs['skipped_lines'] = meta['skipped_lines']
+                _warn_skipped(path, meta['skipped_lines'])
+            else:
+                df = parse_pubs(path)
+            _write_snapshot(snap, {'version': SNAPSHOT_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+                                   'sha1': sha1, 'skipped_lines': df.attrs['skipped_lines'], 'frame': df})
+    if drop_bad:
+        skipped = df.attrs.get('skipped_lines', [])
+        df = df[df['coords_ok']].reset_index(drop=True)
+        df.attrs['skipped_lines'] = skipped
+    return df
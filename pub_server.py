@@ -0,0 +1,234 @@
+import argparse
+import json
+import math
+from functools import lru_cache
+import numpy as np
+from flask import Flask, Response, abort, render_template_string, request
+from pub_data import PUBS_CSV, load_pubs
+
+# points are keyed by their tile at this zoom, so any coarser tile is one contiguous slice
+MAX_ZOOM = 20
+# below this zoom tiles return clusters instead of raw points
+CLUSTER_MAX_ZOOM = 15
+# clusters are cells this many zoom levels below the tile, i.e. 8x8 per tile
+CLUSTER_DEPTH = 3
+# a bbox request is answered from at most this many tiles across
+BBOX_MAX_TILES = 4
+# OpenStreetMap serves tiles up to this zoom; Leaflet scales them up beyond it
+OSM_MAX_ZOOM = 19
+
+PAGE = """<!DOCTYPE html>
+<html>
+<head>
+    <meta http-equiv="content-type" content="text/html; charset=UTF-8" />
+    <meta name="viewport" content="width=device-width, initial-scale=1.0" />
+    <link rel="stylesheet" href="https://cdn.jsdelivr.net/npm/leaflet@1.6.0/dist/leaflet.css"/>
+    <script src="https://cdn.jsdelivr.net/npm/leaflet@1.6.0/dist/leaflet.js"></script>
+    <style>html, body, #map {width: 100%; height: 100%; margin: 0; padding: 0;}</style>
+</head>
+<body>
+<div id="map"></div>
+<script>
+    var map = L.map('map', {preferCanvas: true}).setView([51.51, -0.12], 12);
+    L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
+        attribution: 'Data by &copy; <a href="http://openstreetmap.org">OpenStreetMap</a>',
+        maxZoom: {{ max_zoom }},
+        maxNativeZoom: {{ osm_max_zoom }}
+    }).addTo(map);
+    var renderer = L.canvas({padding: 0.5});
+
+    // only the visible tiles are requested; Leaflet unloads the rest as the view moves
+    var PubTiles = L.GridLayer.extend({
+        createTile: function(coords, done) {
+            var tile = document.createElement('div');
+            var key = this._tileCoordsToKey(coords);
+            var self = this;
+            fetch('tiles/' + coords.z + '/' + coords.x + '/' + coords.y + '.json')
+                .then(function(r) { return r.json(); })
+                .then(function(data) {
+                    if (self._tiles[key]) {
+                        self._layers[key] = drawTile(data).addTo(map);
+                    }
+                    done(null, tile);
+                })
+                .catch(function(err) { done(err, tile); });
+            return tile;
+        },
+        onAdd: function(m) {
+            this._layers = {};
+            this.on('tileunload', function(e) {
+                var key = this._tileCoordsToKey(e.coords);
+                if (this._layers[key]) {
+                    map.removeLayer(this._layers[key]);
+                    delete this._layers[key];
+                }
+            });
+            L.GridLayer.prototype.onAdd.call(this, m);
+        }
+    });
+
+    function drawTile(data) {
+        var group = L.featureGroup();
+        (data.clusters || []).forEach(function(c) {
+            var m = L.circleMarker([c[0], c[1]], {
+                renderer: renderer, radius: 4 + 2 * Math.log(c[2]), weight: 1,
+                color: '#2f3e58', fillColor: '#e84e1b', fillOpacity: 0.6
+            });
+            m.bindTooltip(c[2] + (c[2] === 1 ? ' pub' : ' pubs'));
+            group.addLayer(m);
+        });
+        (data.points || []).forEach(function(p) {
+            var m = L.circleMarker([p[0], p[1]], {
+                renderer: renderer, radius: 5, weight: 1,
+                color: '#2f3e58', fillColor: '#e84e1b', fillOpacity: 0.8
+            });
+            m.pub = p;
+            group.addLayer(m);
+        });
+        group.on('click', function(e) {
+            var pub = e.layer.pub;
+            if (!pub) { return; }
+            var content = document.createElement('div');
+            content.appendChild(document.createTextNode(pub[2]));
+            content.appendChild(document.createElement('br'));
+            content.appendChild(document.createTextNode(pub[3]));
+            L.popup().setLatLng(e.latlng).setContent(content).openOn(map);
+        });
+        return group;
+    }
+
+    new PubTiles({tileSize: 256, maxZoom: {{ max_zoom }}}).addTo(map);
+</script>
+</body>
+</html>
+"""
+
+
+def _interleave(x, y):
+    key = np.zeros(len(x), dtype='uint64')
+    x = x.astype('uint64')
+    y = y.astype('uint64')
+    for bit in range(MAX_ZOOM):
+        key |= ((x >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit)
+        key |= ((y >> np.uint64(bit)) & np.uint64(1)) << np.uint64(2 * bit + 1)
+    return key
+
+
+def mercator(lat, lng):
+    """Web Mercator position in [0, 1) for each latitude/longitude."""
+    lat = np.radians(np.clip(lat, -85.0511, 85.0511))
+    mx = (np.asarray(lng, dtype='float64') + 180.0) / 360.0
+    my = (1.0 - np.log(np.tan(lat) + 1.0 / np.cos(lat)) / np.pi) / 2.0
+    return np.clip(mx, 0, np.nextafter(1, 0)), np.clip(my, 0, np.nextafter(1, 0))
+
+
+class TileSource:
+    """Pub points sorted by tile key, with an LRU cache of encoded tiles."""
+
+    def __init__(self, pubs_df, cache_size=4096):
+        pubs_df = pubs_df[pubs_df['coords_ok']]
+        mx, my = mercator(pubs_df['latitude'].to_numpy(), pubs_df['longitude'].to_numpy())
+        scale = float(1 << MAX_ZOOM)
+        keys = _interleave(np.floor(mx * scale), np.floor(my * scale))
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.mx = mx[order]
+        self.my = my[order]
+        self.lat = pubs_df['latitude'].to_numpy()[order]
+        self.lng = pubs_df['longitude'].to_numpy()[order]
+        self.names = pubs_df['name'].to_numpy()[order]
+        self.areas = pubs_df['local_authority'].astype(str).to_numpy()[order]
+        self.tile = lru_cache(maxsize=cache_size)(self._tile)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _tile_rows(self, z, x, y):
+        shift = np.uint64(2 * (MAX_ZOOM - z))
+        base = _interleave(np.array([x]), np.array([y]))[0]
+        lo = base << shift
+        hi = (base + np.uint64(1)) << shift
+        start, stop = np.searchsorted(self.keys, [lo, hi])
+        return np.arange(start, stop)
+
+    def _encode(self, idx, zoom):
+        if zoom >= CLUSTER_MAX_ZOOM:
+            points = [[round(a, 6), round(b, 6), n, la] for a, b, n, la in
+                      zip(self.lat[idx].tolist(), self.lng[idx].tolist(), self.names[idx].tolist(),
+                          self.areas[idx].tolist())]
+            return {'points': points}
+        # cells CLUSTER_DEPTH levels below the tile; the key prefix is the cell
+        level = min(zoom + CLUSTER_DEPTH, MAX_ZOOM)
+        cells = self.keys[idx] >> np.uint64(2 * (MAX_ZOOM - level))
+        _, inverse, counts = np.unique(cells, return_inverse=True, return_counts=True)
+        lat = np.bincount(inverse, weights=self.lat[idx]) / counts
+        lng = np.bincount(inverse, weights=self.lng[idx]) / counts
+        return {'clusters': [[round(a, 6), round(b, 6), c] for a, b, c in
+                             zip(lat.tolist(), lng.tolist(), counts.tolist())]}
+
+    def _tile(self, z, x, y):
+        idx = self._tile_rows(z, x, y)
+        return json.dumps(self._encode(idx, z), separators=(',', ':'))
+
+    def bbox(self, west, south, east, north, zoom=None):
+        """Pubs in the box, clustered as a tile at zoom would be; zoom defaults to the box's own scale."""
+        (x0, x1), (y1, y0) = mercator(np.array([south, north]), np.array([west, east]))
+        # cover the box with a few tiles, then trim to the exact box
+        cover = MAX_ZOOM
+        while cover > 0 and max(x1 - x0, y1 - y0) * (1 << cover) > BBOX_MAX_TILES - 1:
+            cover -= 1
+        if zoom is None:
+            # the zoom at which the box fills a few tiles, as a map showing it would be
+            zoom = cover
+        n = 1 << cover
+        parts = [self._tile_rows(cover, tx, ty)
+                 for tx in range(int(x0 * n), min(int(x1 * n), n - 1) + 1)
+                 for ty in range(int(y0 * n), min(int(y1 * n), n - 1) + 1)]
+        idx = np.concatenate(parts) if parts else np.zeros(0, dtype='int64')
+        inside = ((self.mx[idx] >= x0) & (self.mx[idx] <= x1)
+                  & (self.my[idx] >= y0) & (self.my[idx] <= y1))
+        return json.dumps(self._encode(np.sort(idx[inside]), zoom), separators=(',', ':'))
+
+
+def create_app(source):
+    app = Flask(__name__)
+
+    @app.route('/')
+    def index():
+        return render_template_string(PAGE, max_zoom=MAX_ZOOM, osm_max_zoom=OSM_MAX_ZOOM)
+
+    @app.route('/tiles/<int:z>/<int:x>/<int:y>.json')
+    def tile(z, x, y):
+        if z > MAX_ZOOM or not (0 <= x < 1 << z and 0 <= y < 1 << z):
+            abort(404)
+        return Response(source.tile(z, x, y), mimetype='application/json')
+
+    @app.route('/bbox')
+    def bbox():
+        try:
+            west, south, east, north = (float(request.args[k]) for k in ('west', 'south', 'east', 'north'))
+            zoom = int(request.args['zoom']) if 'zoom' in request.args else None
+        except (KeyError, ValueError):
+            abort(400)
+        if not all(math.isfinite(v) for v in (west, south, east, north)):
+            abort(400)
+        if west > east or south > north or not (zoom is None or 0 <= zoom <= MAX_ZOOM):
+            abort(400)
+        return Response(source.bbox(west, south, east, north, zoom), mimetype='application/json')
+
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Serve pub points by tile or bounding box.')
+    parser.add_argument('--csv', default=PUBS_CSV)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5000)
+    parser.add_argument('--cache-size', type=int, default=4096, help='tiles kept in the LRU cache')
+    args = parser.parse_args(argv)
+    source = TileSource(load_pubs(args.csv), cache_size=args.cache_size)
+    create_app(source).run(host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
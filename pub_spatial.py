@@ -0,0 +1,202 @@
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from scipy.spatial import cKDTree
+from pub_data import PUBS_CSV, load_pubs, normalise_postcode
+
+OUTPUT_COLUMNS = ['fas_id', 'name', 'postcode', 'easting', 'northing', 'local_authority']
+# roughly the Greater London grid extent
+LONDON_LO, LONDON_HI = np.array([503000.0, 155000.0]), np.array([562000.0, 201000.0])
+
+
+class PubIndex:
+    """KD-tree over British National Grid easting/northing (metres)."""
+
+    def __init__(self, pubs_df):
+        self.pubs = pubs_df[pubs_df['grid_ok']].reset_index(drop=True)
+        self.xy = np.column_stack([self.pubs['easting'].to_numpy(dtype='float64'),
+                                   self.pubs['northing'].to_numpy(dtype='float64')])
+        self.tree = cKDTree(self.xy)
+        # output columns picked once; take() on them is much cheaper per call than .loc
+        self._out = self.pubs[OUTPUT_COLUMNS]
+        self._postcodes = None
+
+    @classmethod
+    def from_csv(cls, path=PUBS_CSV):
+        return cls(load_pubs(path))
+
+    def __len__(self):
+        return len(self.xy)
+
+    def _rows(self, idx, dist=None):
+        out = self._out.take(idx).reset_index(drop=True)
+        if dist is not None:
+            out['distance_m'] = np.round(dist, 1)
+        return out
+
+    def postcode_point(self, postcode):
+        # a postcode's location is the mean grid position of the pubs that carry it
+        if self._postcodes is None:
+            keys = self.pubs['postcode'].map(normalise_postcode)
+            grouped = self.pubs[['easting', 'northing']].astype('float64').groupby(keys.to_numpy()).mean()
+            self._postcodes = dict(zip(grouped.index, grouped.to_numpy()))
+        try:
+            return self._postcodes[normalise_postcode(postcode)]
+        except KeyError:
+            raise ValueError('unknown postcode: {}'.format(postcode)) from None
+
+    def nearest_many(self, points, k=1):
+        """Distances and row positions of the k nearest pubs for each of an (n, 2) array of points."""
+        if k < 1:
+            raise ValueError('k must be at least 1, got {}'.format(k))
+        k = min(k, len(self))
+        dist, idx = self.tree.query(np.asarray(points, dtype='float64').reshape(-1, 2), k=k)
+        return dist.reshape(-1, k), idx.reshape(-1, k)
+
+    def within_many(self, points, radius):
+        """Row positions of the pubs within radius metres of each point."""
+        if np.any(~(np.asarray(radius) >= 0)):
+            raise ValueError('radius must be a non-negative number of metres, got {}'.format(radius))
+        return self.tree.query_ball_point(np.asarray(points, dtype='float64').reshape(-1, 2), radius)
+
+    def bbox_many(self, boxes):
+        """Row positions of the pubs inside each (xmin, ymin, xmax, ymax) box."""
+        boxes = np.asarray(boxes, dtype='float64').reshape(-1, 4)
+        centres = (boxes[:, :2] + boxes[:, 2:]) / 2
+        half = np.max(boxes[:, 2:] - centres, axis=1)
+        # a square Chebyshev ball around the centre covers the box, then trim the long side
+        candidates = self.tree.query_ball_point(centres, half, p=np.inf)
+        out = []
+        for box, cand in zip(boxes, candidates):
+            cand = np.asarray(cand, dtype='int64')
+            xy = self.xy[cand]
+            inside = ((xy[:, 0] >= box[0]) & (xy[:, 0] <= box[2])
+                      & (xy[:, 1] >= box[1]) & (xy[:, 1] <= box[3]))
+            out.append(np.sort(cand[inside]))
+        return out
+
+    def nearest(self, easting, northing, k=5):
+        dist, idx = self.nearest_many([easting, northing], k)
+        return self._rows(idx[0], dist[0])
+
+    def within(self, easting, northing, radius):
+        idx = np.asarray(self.within_many([easting, northing], radius)[0], dtype='int64')
+        dist = np.hypot(*(self.xy[idx] - [easting, northing]).T)
+        order = np.argsort(dist, kind='stable')
+        return self._rows(idx[order], dist[order])
+
+    def in_bbox(self, xmin, ymin, xmax, ymax):
+        return self._rows(self.bbox_many([xmin, ymin, xmax, ymax])[0])
+
+
+def _brute_nearest(xy, points, k):
+    out = np.empty((len(points), k), dtype='int64')
+    for i, p in enumerate(points):
+        d2 = ((xy - p) ** 2).sum(axis=1)
+        part = np.argpartition(d2, k - 1)[:k]
+        out[i] = part[np.argsort(d2[part])]
+    return out
+
+
+def _brute_within(xy, points, radius):
+    return [np.flatnonzero(((xy - p) ** 2).sum(axis=1) <= radius * radius) for p in points]
+
+
+def _brute_bbox(xy, boxes):
+    return [np.flatnonzero((xy[:, 0] >= b[0]) & (xy[:, 0] <= b[2]) & (xy[:, 1] >= b[1]) & (xy[:, 1] <= b[3]))
+            for b in boxes]
+
+
+def random_index(n, rng):
+    """PubIndex over n pubs scattered uniformly across the London grid extent."""
+    xy = np.round(rng.uniform(LONDON_LO, LONDON_HI, size=(n, 2)))
+    return PubIndex(pd.DataFrame({
+        'fas_id': np.arange(n), 'name': '', 'postcode': '',
+        'easting': xy[:, 0].astype('int64'), 'northing': xy[:, 1].astype('int64'),
+        'local_authority': '', 'grid_ok': True,
+    }))
+
+
+def random_boxes(points, rng, min_side=200.0, max_side=2000.0):
+    half = rng.uniform(min_side, max_side, size=(len(points), 2)) / 2
+    return np.hstack([points - half, points + half])
+
+
+def benchmark(sizes=(4514, 1000000), queries=1000, k=5, radius=500.0, seed=0):
+    """Per-query microseconds for PubIndex lookups and brute force, at each index size."""
+    rng = np.random.default_rng(seed)
+    rows = []
+    for n in sizes:
+        t = time.perf_counter()
+        index = random_index(n, rng)
+        build = time.perf_counter() - t
+        points = rng.uniform(LONDON_LO, LONDON_HI, size=(queries, 2))
+        boxes = random_boxes(points, rng)
+        # brute force is slow at 1M points, so time a slice of the queries and scale up
+        m = queries if n < 100000 else max(1, queries // 50)
+        timings = {}
+        for name, run, count in [
+                ('knn', lambda: index.nearest_many(points, k), queries),
+                ('brute knn', lambda: _brute_nearest(index.xy, points[:m], k), m),
+                ('radius', lambda: index.within_many(points, radius), queries),
+                ('brute radius', lambda: _brute_within(index.xy, points[:m], radius), m),
+                ('bbox', lambda: index.bbox_many(boxes), queries),
+                ('brute bbox', lambda: _brute_bbox(index.xy, boxes[:m]), m),
+                # the single-point calls also build the result DataFrame
+                ('nearest()', lambda: [index.nearest(x, y, k) for x, y in points[:m]], m)]:
+            t = time.perf_counter()
+            run()
+            timings[name] = (time.perf_counter() - t) / count * 1e6
+        rows.append((n, build, timings))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Nearest-pub, radius and bounding box lookups on easting/northing.')
+    parser.add_argument('--csv', default=PUBS_CSV)
+    sub = parser.add_subparsers(dest='command', required=True)
+    for name in ('nearest', 'within'):
+        p = sub.add_parser(name)
+        where = p.add_mutually_exclusive_group(required=True)
+        where.add_argument('--point', nargs=2, type=float, metavar=('EASTING', 'NORTHING'))
+        where.add_argument('--postcode')
+        if name == 'nearest':
+            p.add_argument('-k', type=int, default=5)
+        else:
+            p.add_argument('-r', '--radius', type=float, required=True, help='metres')
+    p = sub.add_parser('bbox')
+    p.add_argument('box', nargs=4, type=float, metavar=('XMIN', 'YMIN', 'XMAX', 'YMAX'))
+    p = sub.add_parser('bench')
+    p.add_argument('--sizes', nargs='+', type=int, default=[4514, 1000000])
+    p.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args(argv)
+
+    if args.command == 'bench':
+        print('microseconds per query')
+        for i, (n, build, timings) in enumerate(benchmark(args.sizes, args.queries)):
+            if i == 0:
+                print('{:>9} {:>9}'.format('points', 'build s') + ''.join('{:>13}'.format(t) for t in timings))
+            print('{:>9} {:>9.3f}'.format(n, build) + ''.join('{:>13.1f}'.format(v) for v in timings.values()))
+        return
+    if args.command == 'nearest' and args.k < 1:
+        parser.error('-k must be at least 1')
+    if args.command == 'within' and not args.radius >= 0:
+        parser.error('--radius must not be negative')
+    index = PubIndex.from_csv(args.csv)
+    if args.command == 'bbox':
+        result = index.in_bbox(*args.box)
+    else:
+        try:
+            point = args.point if args.point else index.postcode_point(args.postcode)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.command == 'nearest':
+            result = index.nearest(point[0], point[1], args.k)
+        else:
+            result = index.within(point[0], point[1], args.radius)
+    print(result.to_string(index=False))
+
+
+if __name__ == '__main__':
+    main()
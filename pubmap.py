@@ -0,0 +1,158 @@
+"""pubmap: build the pub maps and charts, rebuilding only what is out of date.
+
+Only the standard library is imported up front; each target imports its own
+heavy dependencies when, and only if, it has to be rebuilt.
+"""
+import time
+
+_T0 = time.perf_counter()
+
+import argparse
+import importlib
+import json
+import os
+import sys
+
+BUILD_STATE = os.path.join('.pub_cache', 'build.json')
+# same as heat_map.KERNELS, repeated so checking --kernel doesn't import numpy
+HEAT_KERNELS = ('gaussian', 'epanechnikov', 'box', 'none')
+_import_seconds = {}
+
+
+def _lazy_import(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    t = time.perf_counter()
+    module = importlib.import_module(name)
+    _import_seconds[name] = time.perf_counter() - t
+    return module
+
+
+def build_counts(args):
+    pub_aggregate = _lazy_import('pub_aggregate')
+    counts = pub_aggregate.borough_counts(args.csv)
+    counts[['Local Authority', 'Number of Pubs']].to_csv(pub_aggregate.COUNTS_CSV, index=False)
+
+
+def build_markers(args):
+    map_with_markers = _lazy_import('map_with_markers')
+    pub_data = _lazy_import('pub_data')
+    map_with_markers.build_marker_map(pub_data.load_pubs(args.csv), per_marker=args.per_marker).save(
+        'london_pubs.html')
+
+
+def build_heatmap(args):
+    heat_map = _lazy_import('heat_map')
+    heat_map.main(['--csv', args.csv, '--mode', args.heat_mode, '--kernel', args.kernel,
+                   '--bandwidth', str(args.bandwidth)])
+
+
+def build_charts(args):
+    pd = _lazy_import('pandas')
+    pub_charts = _lazy_import('pub_charts')
+    # run() only gets here when the target is stale, e.g. pub_charts.py changed, which
+    # render_charts' own manifest can't see, so don't let it skip anything
+    pub_charts.render_charts(pub_charts.london_charts(pd.read_csv('every_pub_in_london.csv')),
+                             workers=args.workers, force=True)
+
+
+# name: (inputs, outputs, builder, options that change the output); in build order
+TARGETS = {
+    'counts': (['{csv}', 'pub_aggregate.py', 'pub_data.py', 'osgb.py'], ['every_pub_in_london.csv'],
+               build_counts, []),
+    'markers': (['{csv}', 'map_with_markers.py', 'pub_data.py', 'osgb.py'], ['london_pubs.html'],
+                build_markers, ['per_marker']),
+    'heatmap': (['{csv}', 'heat_map.py', 'pub_data.py', 'osgb.py'], ['ldn_pubs_heat.npz', 'ldn_pubs_heat.html'],
+                build_heatmap, ['heat_mode', 'kernel', 'bandwidth']),
+    'charts': (['every_pub_in_london.csv', 'pub_charts.py'], ['bar_chart1.png', 'pie_chart1.png', 'bar_chart2.png'],
+               build_charts, []),
+}
+COMMANDS = {
+    'markers': ['markers'],
+    'heatmap': ['heatmap'],
+    'charts': ['counts', 'charts'],
+    'all': ['counts', 'markers', 'heatmap', 'charts'],
+}
+
+
+def _signature(path):
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _load_state(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(path, state):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path + '.tmp', 'w') as f:
+        json.dump(state, f, indent=1, sort_keys=True)
+    os.replace(path + '.tmp', path)
+
+
+def target_stamp(name, args):
+    inputs, _, _, options = TARGETS[name]
+    return {'inputs': {p.format(csv=args.csv): _signature(p.format(csv=args.csv)) for p in inputs},
+            'options': {o: getattr(args, o) for o in options}}
+
+
+def is_stale(name, args, state):
+    _, outputs, _, _ = TARGETS[name]
+    if any(_signature(out) is None for out in outputs):
+        return True
+    return state.get(name) != target_stamp(name, args)
+
+
+def run(names, args, log=sys.stderr):
+    """Build the stale targets among names, in dependency order; returns the names rebuilt."""
+    state = _load_state(BUILD_STATE)
+    built = []
+    for name in [n for n in TARGETS if n in names]:
+        if not args.force and not is_stale(name, args, state):
+            print('{:<8} up to date'.format(name), file=log)
+            continue
+        missing = [p for p in target_stamp(name, args)['inputs'] if _signature(p) is None]
+        if missing:
+            raise SystemExit('pubmap: {} needs {}'.format(name, ', '.join(missing)))
+        if args.dry_run:
+            print('{:<8} stale'.format(name), file=log)
+            continue
+        t = time.perf_counter()
+        TARGETS[name][2](args)
+        # stamp after building so outputs that feed later targets are seen as changed
+        state[name] = target_stamp(name, args)
+        _save_state(BUILD_STATE, state)
+        built.append(name)
+        print('{:<8} built in {:.0f} ms'.format(name, (time.perf_counter() - t) * 1000), file=log)
+    return built
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='pubmap', description=__doc__.splitlines()[0])
+    parser.add_argument('command', choices=sorted(COMMANDS))
+    parser.add_argument('--csv', default='london_pubs.csv')
+    parser.add_argument('--force', action='store_true', help='rebuild even if up to date')
+    parser.add_argument('--dry-run', action='store_true', help='only list what is stale')
+    parser.add_argument('--per-marker', action='store_true', help='one folium.Marker per pub (slow)')
+    parser.add_argument('--heat-mode', choices=('points', 'image'), default='points')
+    parser.add_argument('--kernel', choices=HEAT_KERNELS, default='gaussian')
+    parser.add_argument('--bandwidth', type=float, default=500.0)
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args(argv)
+    startup = time.perf_counter() - _T0
+    run(COMMANDS[args.command], args)
+    imports = ', '.join('{} {:.0f} ms'.format(name, s * 1000) for name, s in _import_seconds.items())
+    print('startup {:.0f} ms; imports: {}; total {:.0f} ms'.format(
+        startup * 1000, imports or 'none', (time.perf_counter() - _T0) * 1000), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import os
+import numpy as np
+import pandas as pd
+from osgb import grid_to_osgb36, grid_to_wgs84, osgb36_to_grid, wgs84_to_grid
+
+# worked example from the OS guide to coordinate systems in Great Britain
+EXAMPLE_LAT = np.radians(52 + 39 / 60 + 27.2531 / 3600)
+EXAMPLE_LNG = np.radians(1 + 43 / 60 + 4.5177 / 3600)
+EXAMPLE_E, EXAMPLE_N = 651409.903, 313177.270
+
+
+def test_worked_example_to_grid():
+    e, n = osgb36_to_grid(EXAMPLE_LAT, EXAMPLE_LNG)
+    assert abs(e - EXAMPLE_E) < 1e-3
+    assert abs(n - EXAMPLE_N) < 1e-3
+
+
+def test_worked_example_from_grid():
+    lat, lng = grid_to_osgb36(np.array([EXAMPLE_E]), np.array([EXAMPLE_N]))
+    # 1e-8 radians is about 6 cm
+    assert abs(lat[0] - EXAMPLE_LAT) < 1e-8
+    assert abs(lng[0] - EXAMPLE_LNG) < 1e-8
+
+
+def test_wgs84_round_trip():
+    rng = np.random.default_rng(0)
+    e = rng.uniform(100000, 650000, 1000)
+    n = rng.uniform(20000, 1200000, 1000)
+    e2, n2 = wgs84_to_grid(*grid_to_wgs84(e, n))
+    assert np.abs(e2 - e).max() < 0.01
+    assert np.abs(n2 - n).max() < 0.01
+
+
+def test_nan_in_nan_out():
+    lat, lng = grid_to_wgs84(np.array([530000.0, np.nan]), np.array([181000.0, 181000.0]))
+    assert np.isfinite(lat[0]) and np.isfinite(lng[0])
+    assert np.isnan(lat[1]) and np.isnan(lng[1])
+    e, n = wgs84_to_grid(np.array([51.5, np.nan]), np.array([-0.12, -0.12]))
+    assert np.isfinite(e[0]) and np.isfinite(n[0])
+    assert np.isnan(e[1]) and np.isnan(n[1])
+
+
+def test_matches_published_coordinates():
+    # a wrong Helmert sign is still self-consistent, so also check against the feed's own lat/long
+    pubs = pd.read_csv(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'london_pubs.csv'),
+                       na_values=['\\N']).dropna(subset=['latitude', 'longitude'])
+    pubs = pubs[pubs['easting'].between(0, 700000)]
+    e, n = wgs84_to_grid(pubs['latitude'].to_numpy(), pubs['longitude'].to_numpy())
+    assert np.median(np.hypot(e - pubs['easting'], n - pubs['northing'])) < 1.0
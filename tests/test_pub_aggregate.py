@@ -0,0 +1,100 @@
+import os
+import shutil
+import pandas as pd
+import pytest
+from pub_aggregate import BoroughAggregate, borough_aggregate, borough_counts
+from pub_data import parse_pubs
+
+LONDON_PUBS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'london_pubs.csv')
+
+
+@pytest.fixture
+def pubs_csv(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    path = tmp_path / 'london_pubs.csv'
+    shutil.copy(LONDON_PUBS, path)
+    return str(path)
+
+
+def full_counts(path):
+    return BoroughAggregate.from_frame(parse_pubs(path)).summary()
+
+
+def test_mid_file_edit_recomputes(pubs_csv):
+    borough_counts(pubs_csv)
+    with open(pubs_csv) as f:
+        lines = f.read().split('\n')
+    row = next(i for i, line in enumerate(lines) if line.endswith(',Camden'))
+    lines[row] = lines[row][:-len('Camden')] + 'Barnet'
+    with open(pubs_csv, 'w') as f:
+        f.write('\n'.join(lines))
+    pd.testing.assert_frame_equal(borough_counts(pubs_csv), full_counts(pubs_csv))
+
+
+def test_append_to_unterminated_last_row(pubs_csv):
+    total = borough_counts(pubs_csv)['Number of Pubs'].sum()
+    with open(pubs_csv, 'rb') as f:
+        last_id = int(f.read().rsplit(b'\n', 1)[1].split(b',', 1)[0])
+    # the file has no trailing newline, so this joins the last row
+    row = '999999,New Pub,"1 Road, London",N1 1AA,530000,181000,51.5,-0.12,Camden\n'
+    with open(pubs_csv, 'a') as f:
+        f.write(row)
+    agg = borough_aggregate(pubs_csv)
+    assert agg.summary()['Number of Pubs'].sum() == total + 1
+    assert last_id in agg.rows and 999999 in agg.rows
+    assert agg.skipped_lines == 0
+    expected = os.path.join(os.path.dirname(pubs_csv), 'expected.csv')
+    shutil.copy(LONDON_PUBS, expected)
+    with open(expected, 'a') as f:
+        f.write('\n' + row)
+    pd.testing.assert_frame_equal(agg.summary(), full_counts(expected))
+
+
+def test_full_parse_reports_joined_row(pubs_csv):
+    with open(pubs_csv, 'a') as f:
+        f.write('999999,New Pub,"1 Road, London",N1 1AA,530000,181000,51.5,-0.12,Camden\n')
+    with pytest.warns(UserWarning, match='skipped 1 line'):
+        df = parse_pubs(pubs_csv)
+    assert len(df.attrs['skipped_lines']) == 1
+    with pytest.warns(UserWarning, match='skipped 1 line'):
+        assert borough_aggregate(pubs_csv).skipped_lines == 1
+
+
+def test_append_rows_without_fas_id(pubs_csv):
+    borough_counts(pubs_csv)
+    with open(pubs_csv, 'a') as f:
+        f.write('\n,Nameless,"2 Road, London",N1 1AA,530000,181000,51.5,-0.12,Camden\n')
+        f.write('abc,Bad Id,"3 Road, London",N1 1AA,530000,181000,51.5,-0.12,Camden\n')
+        f.write('999998,Good Pub,"4 Road, London",N1 1AA,530000,181000,51.5,-0.12,Camden\n')
+    counts = borough_counts(pubs_csv)
+    pd.testing.assert_frame_equal(counts, full_counts(pubs_csv))
+    assert counts['Number of Pubs'].sum() == len(parse_pubs(LONDON_PUBS, fill_missing=False)) + 1
+
+
+def test_postcode_cache_beside_csv(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    other = tmp_path / 'other'
+    other.mkdir()
+    shutil.copy(LONDON_PUBS, other / 'pubs.csv')
+    borough_counts(str(other / 'pubs.csv'))
+    assert (other / '.pub_cache' / 'pubs.csv.postcodes.csv').exists()
+    assert not (tmp_path / '.pub_cache').exists()
+
+
+def test_postcode_cache_per_csv(tmp_path):
+    (tmp_path / 'alone').mkdir()
+    shutil.copy(LONDON_PUBS, tmp_path / 'alone' / 'london_pubs.csv')
+    alone = parse_pubs(str(tmp_path / 'alone' / 'london_pubs.csv'))
+    # a second, larger table in the same directory with every pub half a degree further north
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    shutil.copy(LONDON_PUBS, shared / 'london_pubs.csv')
+    shifted = pd.read_csv(LONDON_PUBS, dtype=str, keep_default_na=False)
+    located = shifted['latitude'] != '\\N'
+    shifted.loc[located, 'latitude'] = (shifted.loc[located, 'latitude'].astype(float) + 0.5).astype(str)
+    pd.concat([shifted, shifted]).to_csv(shared / 'shifted.csv', index=False)
+    parse_pubs(str(shared / 'shifted.csv'))
+    df = parse_pubs(str(shared / 'london_pubs.csv'))
+    filled = (df['coords_source'] != 'csv').to_numpy()
+    assert filled.any()
+    pd.testing.assert_frame_equal(df[filled], alone[filled])
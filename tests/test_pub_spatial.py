@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+from pub_spatial import (LONDON_HI, LONDON_LO, _brute_bbox, _brute_nearest, _brute_within, random_boxes,
+                         random_index)
+
+
+@pytest.fixture
+def index_and_points():
+    rng = np.random.default_rng(0)
+    index = random_index(20000, rng)
+    points = rng.uniform(LONDON_LO, LONDON_HI, size=(200, 2))
+    return index, points, random_boxes(points, rng)
+
+
+def test_nearest_matches_brute_force(index_and_points):
+    index, points, _ = index_and_points
+    dist, idx = index.nearest_many(points, 5)
+    brute = _brute_nearest(index.xy, points, 5)
+    brute_dist = np.hypot(*(index.xy[brute] - points[:, None, :]).transpose(2, 0, 1))
+    # ties may come back in either order, so compare distances
+    np.testing.assert_allclose(dist, brute_dist)
+
+
+def test_within_matches_brute_force(index_and_points):
+    index, points, _ = index_and_points
+    for got, want in zip(index.within_many(points, 500.0), _brute_within(index.xy, points, 500.0)):
+        assert sorted(got) == want.tolist()
+
+
+def test_bbox_matches_brute_force(index_and_points):
+    index, _, boxes = index_and_points
+    for got, want in zip(index.bbox_many(boxes), _brute_bbox(index.xy, boxes)):
+        assert got.tolist() == want.tolist()
+
+
+def test_rejects_bad_k_and_radius(index_and_points):
+    index, points, _ = index_and_points
+    with pytest.raises(ValueError):
+        index.nearest_many(points, 0)
+    with pytest.raises(ValueError):
+        index.within_many(points, -5.0)
+    with pytest.raises(ValueError):
+        index.within(530000, 181000, float('nan'))
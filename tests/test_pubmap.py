@@ -0,0 +1,6 @@
+import heat_map
+import pubmap
+
+
+def test_heat_kernels_match_heat_map():
+    assert pubmap.HEAT_KERNELS == heat_map.KERNELS